@@ -1,36 +1,209 @@
 import functions_framework
 import base64
+import hashlib
+import hmac
 import os
+import threading
 from flask import jsonify, make_response
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import matplotlib
-matplotlib.use('Agg')  # Use non-GUI backend
-import matplotlib.pyplot as plt
+from functools import lru_cache
 from io import BytesIO
-import numpy as np
-import json
-import pytz
+from types import SimpleNamespace
+from urllib.parse import quote
+import math
+import orjson
+import time
+from zoneinfo import ZoneInfo
 
 # Environment variables
 POLYGON_API_KEY = os.environ.get('POLYGON_API_KEY')
 BASIC_AUTH_USERNAME = os.environ.get('BASIC_AUTH_USERNAME', 'admin')
 BASIC_AUTH_PASSWORD = os.environ.get('BASIC_AUTH_PASSWORD')
 
+# Decoded Basic auth credentials ("username:password") that requests must match
+EXPECTED_CREDENTIALS = (f"{BASIC_AUTH_USERNAME}:{BASIC_AUTH_PASSWORD}".encode('utf-8')
+                        if BASIC_AUTH_PASSWORD else None)
+
+# Shared HTTP session so connections to Polygon.io are kept alive between calls.
+# Connection failures and timeouts get one retry before giving up.
+POLYGON_TIMEOUT = 5.0  # Seconds, per connect/read
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=1, status=0, backoff_factor=0.2)
+))
+
+# Worker threads for running independent Polygon.io calls concurrently
+EXECUTOR = ThreadPoolExecutor(max_workers=8)
+
+# Cache settings
+CACHE_DIR = '/tmp/.cache'
+# Most (ticker, duration) price series kept in process memory at once
+MEMORY_CACHE_SIZE = 64
+# How long fetched price data stays fresh for each duration (seconds)
+CACHE_TTL = {
+    'hour': 60,
+    'day': 300,
+    'week': 3600,
+    'month': 86400
+}
+
+# HTTP cache lifetime for generated graphs, per duration (seconds)
+HTTP_CACHE_MAX_AGE = {
+    'hour': 30,
+    'day': 300,
+    'week': 1800,
+    'month': 21600
+}
+
+# Graph styling
+BACKGROUND_COLOR = (255, 255, 255)
+LINE_COLOR = (31, 119, 180)
+FILL_COLOR = (31, 119, 180, 51)  # Line color at 20% opacity
+GRID_COLOR = (176, 176, 176, 77)  # Light gray at 30% opacity
+AXIS_COLOR = (0, 0, 0)
+UP_COLOR = (44, 160, 44)
+DOWN_COLOR = (214, 39, 40)
+LINE_WIDTH = 3
+TICK_LENGTH = 4
+X_LABEL_INSET = 4  # Space below the time axis title
+X_LABEL_GAP = 6  # Space between the time tick labels and the axis title
+# Round step sizes (times a power of ten) allowed between Y-axis ticks
+TICK_STEP_MULTIPLES = (1, 2, 2.5, 5, 10)
+
+# Per-thread PNG output buffer, preallocated so typical images never grow it
+PNG_BUFFER_SIZE = 256 * 1024
+_thread_local = threading.local()
+
+# Axis times are shown in US market time
+EST_TZ = ZoneInfo('US/Eastern')
+MONTH_ABBR = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+              'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def _load_font(size, bold=False):
+    """Load a TrueType font, falling back to Pillow's bundled default font."""
+    from PIL import ImageFont
+    
+    name = 'DejaVuSans-Bold.ttf' if bold else 'DejaVuSans.ttf'
+    try:
+        return ImageFont.truetype(name, size)
+    except OSError:
+        return ImageFont.load_default(size=size)
+
+
+def _vertical_text_mask(text, font):
+    """Render text rotated 90 degrees counter-clockwise into an alpha mask."""
+    from PIL import Image, ImageDraw
+    
+    left, top, right, bottom = font.getbbox(text)
+    mask = Image.new('L', (right - left, bottom - top), 0)
+    ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255)
+    return mask.rotate(90, expand=True)
+
+
+@lru_cache(maxsize=None)
+def _render_assets():
+    """Load fonts and pre-render the fixed axis labels, once per process."""
+    # Font sizes in pixels
+    label_font = _load_font(14)
+    # Measured with the same anchor the time axis title is drawn with
+    _, x_label_top, _, x_label_bottom = label_font.getbbox('Time (EST)', anchor='md')
+    return SimpleNamespace(
+        title_font=_load_font(19, bold=True),
+        price_font=_load_font(17, bold=True),
+        label_font=label_font,
+        tick_font=_load_font(11),
+        y_label_mask=_vertical_text_mask('Price ($)', label_font),
+        x_label_height=x_label_bottom - x_label_top
+    )
+
+
+class FileCache:
+    """JSON file cache shared by all processes on an instance, expired by file mtime."""
+    
+    def __init__(self, directory):
+        self.directory = directory
+    
+    def _path(self, key):
+        # Quote the key so user-supplied tickers can't escape the cache directory
+        return os.path.join(self.directory, f"{quote(key, safe='')}.json")
+    
+    def get(self, key, ttl):
+        """Return (value, stored_at) for key, or (None, None) if missing or older than ttl seconds."""
+        path = self._path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if time.time() - stored_at > ttl:
+                return None, None
+            with open(path, 'rb') as f:
+                return orjson.loads(f.read()), stored_at
+        except (OSError, ValueError):
+            return None, None
+    
+    def set(self, key, value):
+        """Store value under key, writing atomically so readers never see partial files."""
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(value))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing cache file {path}: {e}")
+
+
+class MemoryCache:
+    """Bounded in-process LRU cache, expired by the time each entry was stored."""
+    
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, ttl):
+        """Return (value, stored_at) for key, or (None, None) if missing or older than ttl seconds."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[1] > ttl:
+                return None, None
+            self._entries.move_to_end(key)
+            return entry
+    
+    def set(self, key, value, stored_at=None):
+        """Store value under key, replacing any earlier entry and evicting the least recently used."""
+        with self._lock:
+            self._entries[key] = (value, time.time() if stored_at is None else stored_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+stock_data_memory_cache = MemoryCache(MEMORY_CACHE_SIZE)
+stock_data_cache = FileCache(CACHE_DIR)
+
 
 def verify_basic_auth(request):
     """Verify basic authentication."""
     auth_header = request.headers.get('Authorization')
     
-    if not auth_header or not auth_header.startswith('Basic '):
+    if not EXPECTED_CREDENTIALS or not auth_header or not auth_header.startswith('Basic '):
         return False
     
     try:
-        credentials = base64.b64decode(auth_header[6:]).decode('utf-8')
-        username, password = credentials.split(':', 1)
-        return username == BASIC_AUTH_USERNAME and password == BASIC_AUTH_PASSWORD
-    except Exception:
+        credentials = base64.b64decode(auth_header[6:])
+    except ValueError:
         return False
+    
+    # Constant-time comparison so response timing doesn't leak the credentials
+    return hmac.compare_digest(credentials, EXPECTED_CREDENTIALS)
 
 
 def get_duration_params(duration):
@@ -66,24 +239,44 @@ def get_duration_params(duration):
     return start_date, end_date, timespan, multiplier
 
 
-def fetch_company_name(ticker):
-    """Fetch company name from Polygon.io API."""
+@lru_cache(maxsize=8192)
+def _lookup_company_name(ticker):
+    """Look up a company name on Polygon.io, returning None for unknown tickers.
+    
+    Both names and misses are cached for the life of the process; transient
+    failures raise instead so that they are retried on the next request.
+    """
     url = f"https://api.polygon.io/v3/reference/tickers/{ticker}"
     
     params = {
         'apiKey': POLYGON_API_KEY
     }
     
+    response = SESSION.get(url, params=params, timeout=POLYGON_TIMEOUT)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    
+    data = orjson.loads(response.content)
+    if data.get('status') == 'OK' and data.get('results'):
+        return data['results'].get('name')
+    return None
+
+
+def fetch_company_name(ticker):
+    """Fetch company name from Polygon.io API."""
     try:
-        response = requests.get(url, params=params)
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('status') == 'OK' and data.get('results'):
-                return data['results'].get('name', ticker)
+        company_name = _lookup_company_name(ticker)
     except Exception as e:
         print(f"Error fetching company name: {e}")
+        company_name = None
     
-    return ticker  # Fallback to ticker if company name not found
+    return company_name or ticker  # Fallback to ticker if company name not found
+
+
+def _fmt_date(dt):
+    """Format a date as YYYY-MM-DD (same as strftime('%Y-%m-%d'), without its overhead)."""
+    return f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d}"
 
 
 def fetch_stock_data(ticker, start_date, end_date, timespan, multiplier):
@@ -102,11 +295,11 @@ def fetch_stock_data(ticker, start_date, end_date, timespan, multiplier):
         'adjusted': 'true'  # Use adjusted prices
     }
     
-    url = f"{base_url}/{ticker}/range/{multiplier}/{timespan}/{start_date.strftime('%Y-%m-%d')}/{end_date.strftime('%Y-%m-%d')}"
+    url = f"{base_url}/{ticker}/range/{multiplier}/{timespan}/{_fmt_date(start_date)}/{_fmt_date(end_date)}"
     
     print(f"Fetching from URL: {url}")  # Debug URL
     
-    response = requests.get(url, params=params)
+    response = SESSION.get(url, params=params, timeout=POLYGON_TIMEOUT)
     
     # Log full response for debugging
     print(f"Response status code: {response.status_code}")
@@ -115,7 +308,7 @@ def fetch_stock_data(ticker, start_date, end_date, timespan, multiplier):
         print(f"Response body: {response.text}")
         response.raise_for_status()
     
-    data = response.json()
+    data = orjson.loads(response.content)
     
     # Debug logging
     print(f"Polygon API Response Status: {data.get('status')}")
@@ -132,37 +325,44 @@ def fetch_stock_data(ticker, start_date, end_date, timespan, multiplier):
     
     if not data.get('results'):
         # Provide more helpful error message with actual response
-        raise ValueError(f"No data available for {ticker} from {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}. Response: {json.dumps(data)[:200]}")
+        raise ValueError(f"No data available for {ticker} from {_fmt_date(start_date)} to {_fmt_date(end_date)}. Response: {orjson.dumps(data).decode()[:200]}")
     
     return data['results']
 
 
-def create_spark_graph_image(prices, ticker, company_name, size=(480, 480)):
-    """Generate a spark graph image from price data with labels and axes."""
-    # Extract data
-    values = [bar['c'] for bar in prices]
-    timestamps = [bar['t'] for bar in prices]
-    
-    if not values:
-        raise ValueError("No price data available")
-    
-    # Create figure with white background
-    dpi = 100
-    fig_width = size[0] / dpi
-    fig_height = size[1] / dpi
+def get_stock_data(ticker, duration):
+    """Fetch stock data for a duration, reusing cached results while they are fresh."""
+    if duration not in CACHE_TTL:
+        raise ValueError(f"Invalid duration: {duration}")
     
-    fig, ax = plt.subplots(figsize=(fig_width, fig_height), dpi=dpi, facecolor='white')
-    ax.set_facecolor('white')
+    # One slot per ticker and duration in memory and on disk, overwritten in
+    # place, so neither grows with time (/tmp counts against instance memory)
+    ttl = CACHE_TTL[duration]
+    results, _ = stock_data_memory_cache.get((ticker, duration), ttl)
+    if results is not None:
+        return results
     
-    # Create x-axis values
-    x = np.arange(len(values))
+    cache_key = f"{ticker}_{duration}"
+    results, stored_at = stock_data_cache.get(cache_key, ttl)
     
-    # Plot the spark line
-    ax.plot(x, values, color='#1f77b4', linewidth=2.5)
+    if results is None:
+        start_date, end_date, timespan, multiplier = get_duration_params(duration)
+        results = fetch_stock_data(ticker, start_date, end_date, timespan, multiplier)
+        stock_data_cache.set(cache_key, results)
     
-    # Calculate dynamic Y-axis bounds
-    min_price = min(values)
-    max_price = max(values)
+    # Keep the file's timestamp so a copy read from disk expires with it
+    stock_data_memory_cache.set((ticker, duration), results, stored_at)
+    return results
+
+
+def _format_price(x):
+    """Format a Y-axis tick value as currency."""
+    return f'${x:,.0f}' if x >= 1 else f'${x:.2f}'
+
+
+def _price_bounds(values):
+    """Return padded (y_min, y_max) Y-axis bounds for an array of prices."""
+    min_price, max_price = values.min(), values.max()
     price_range = max_price - min_price
     
     # Add padding (5% of range on each side, or at least 0.5% of the price)
@@ -172,64 +372,175 @@ def create_spark_graph_image(prices, ticker, company_name, size=(480, 480)):
         # If no price change, use 1% of price as padding
         padding = min_price * 0.01
     
-    y_min = min_price - padding
-    y_max = max_price + padding
-    
-    # Set Y-axis limits
-    ax.set_ylim(y_min, y_max)
+    return float(min_price - padding), float(max_price + padding)
+
+
+def _to_est(timestamps):
+    """Convert epoch-millisecond timestamps to naive EST datetime64 values.
+    
+    Offsets are looked up at the first and last timestamp only, and per
+    timestamp when those differ. This assumes a range crosses at most one
+    daylight saving change (true for spans under about four months; the
+    longest duration here is 30 days).
+    """
+    import numpy as np
+    
+    utc = timestamps.astype('datetime64[ms]')
+    first_offset, last_offset = (datetime.fromtimestamp(t / 1000, tz=EST_TZ).utcoffset()
+                                 for t in (timestamps[0], timestamps[-1]))
+    
+    if first_offset == last_offset:
+        return utc + np.timedelta64(first_offset)
+    
+    # Range spans a daylight saving change, so look up each offset
+    offsets = [datetime.fromtimestamp(t / 1000, tz=EST_TZ).utcoffset() for t in timestamps]
+    return utc + np.array(offsets, dtype='timedelta64[ms]')
+
+
+def _nice_ticks(lo, hi, max_ticks=5):
+    """Pick evenly spaced, round-valued tick positions between lo and hi."""
+    span = hi - lo
+    if span <= 0:
+        return [lo]
+    
+    raw_step = span / max_ticks
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    for multiple in TICK_STEP_MULTIPLES:
+        step = multiple * magnitude
+        if step >= raw_step:
+            break
+    
+    first = math.ceil(lo / step) * step
+    return [first + i * step for i in range(int((hi - first) // step) + 1)]
+
+
+def create_spark_graph_image(prices, ticker, company_name, size=(480, 480)):
+    """Generate a spark graph image from price data with labels and axes."""
+    # NumPy and Pillow are only needed to render a graph, so they are imported on
+    # first use rather than at module load; auth failures, validation errors and
+    # 304s never pay for them during a cold start.
+    import numpy as np
+    from PIL import Image, ImageDraw
     
-    # Fill area under the curve (from y_min to show relative change)
-    ax.fill_between(x, values, y_min, alpha=0.2, color='#1f77b4')
+    if not prices:
+        raise ValueError("No price data available")
     
-    # Configure axes
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['bottom'].set_linewidth(0.5)
-    ax.spines['left'].set_linewidth(0.5)
+    # Extract close prices and timestamps in a single pass
+    bars = np.fromiter(((bar['c'], bar['t']) for bar in prices),
+                       dtype=[('c', 'f8'), ('t', 'i8')], count=len(prices))
+    values = bars['c']
+    timestamps = bars['t']
     
-    # Add grid
-    ax.grid(True, alpha=0.3, linestyle='-', linewidth=0.5)
-    ax.set_axisbelow(True)
+    width, height = size
     
-    # Y-axis formatting (prices)
-    ax.yaxis.set_major_locator(plt.MaxNLocator(5))
-    ax.set_ylabel('Price ($)', fontsize=10)
+    # Calculate dynamic Y-axis bounds
+    y_min, y_max = _price_bounds(values)
     
-    # Format y-axis labels as currency
-    def format_price(x, p):
-        return f'${x:,.0f}' if x >= 1 else f'${x:.2f}'
-    ax.yaxis.set_major_formatter(plt.FuncFormatter(format_price))
+    # Y-axis ticks (prices)
+    y_ticks = _nice_ticks(y_min, y_max)
+    y_tick_labels = [_format_price(tick) for tick in y_ticks]
     
-    # X-axis formatting (time)
+    # X-axis ticks (time)
     # Select a subset of timestamps to show (avoid overcrowding)
     num_labels = min(6, len(timestamps))
     indices = np.linspace(0, len(timestamps)-1, num_labels, dtype=int)
     
-    ax.set_xticks(indices)
-    
     # Format timestamps based on data range
     time_range = timestamps[-1] - timestamps[0]
     if time_range < 86400000:  # Less than a day (in milliseconds)
-        date_format = '%H:%M'
+        date_format = '{time}'
     elif time_range < 604800000:  # Less than a week
-        date_format = '%b %d\n%H:%M'
+        date_format = '{month} {day}\n{time}'
     else:
-        date_format = '%b %d'
+        date_format = '{month} {day}'
+    
+    # Convert milliseconds to EST and split ISO strings ('YYYY-MM-DDTHH:MM') into fields
+    est_times = np.datetime_as_string(_to_est(timestamps[indices]), unit='m')
+    x_tick_labels = [date_format.format(month=MONTH_ABBR[int(s[5:7]) - 1], day=s[8:10], time=s[11:16])
+                     for s in est_times]
+    
+    # Lay out the plot area around the title, tick labels and axis labels
+    assets = _render_assets()
+    img = Image.new('RGB', size, BACKGROUND_COLOR)
+    draw = ImageDraw.Draw(img, 'RGBA')
+    
+    title = f'{ticker} - {company_name}'
+    title_height = draw.textbbox((0, 0), title, font=assets.title_font)[3]
+    y_tick_width = max(draw.textlength(label, font=assets.tick_font) for label in y_tick_labels)
+    x_tick_height = max(draw.multiline_textbbox((0, 0), label, font=assets.tick_font)[3] for label in x_tick_labels)
+    last_x_tick_width = draw.multiline_textbbox((0, 0), x_tick_labels[-1], font=assets.tick_font)[2]
+    
+    plot_left = int(assets.y_label_mask.width + y_tick_width + 3 * TICK_LENGTH)
+    plot_right = max(int(width - max(15, last_x_tick_width / 2 + TICK_LENGTH)), plot_left + 1)
+    plot_top = int(title_height + 20)
+    # Bottom margin stacks the tick marks and labels, a gap and the axis title
+    x_axis_height = 2 * TICK_LENGTH + x_tick_height + X_LABEL_GAP + assets.x_label_height + X_LABEL_INSET
+    plot_bottom = max(int(height - x_axis_height), plot_top + 1)
+    plot_width = plot_right - plot_left
+    plot_height = plot_bottom - plot_top
+    
+    # Downsample long series to what the image can show, always keeping the last
+    # sample (bounds and annotations still use the full data)
+    sample_indices = np.arange(len(values))
+    if len(values) > 2 * width:
+        step = len(values) // (2 * width)
+        sample_indices = sample_indices[::step]
+        if sample_indices[-1] != len(values) - 1:
+            sample_indices = np.append(sample_indices, len(values) - 1)
+    
+    # Scale prices and sample positions to pixel coordinates
+    scale = plot_height / (y_max - y_min) if y_max > y_min else 0.0
+    x_scale = plot_width / (len(values) - 1) if len(values) > 1 else 0.0
+    x_px = plot_left + sample_indices * x_scale
+    y_px = plot_bottom - (values[sample_indices] - y_min) * scale
+    
+    def to_x(idx):
+        return plot_left + idx * x_scale
+    
+    def to_y(price):
+        return plot_bottom - (price - y_min) * scale
+    
+    # Add grid (drawn first so it sits below the data)
+    for tick in y_ticks:
+        y = to_y(tick)
+        draw.line([(plot_left, y), (plot_right, y)], fill=GRID_COLOR, width=1)
+    for idx in indices:
+        x = to_x(idx)
+        draw.line([(x, plot_top), (x, plot_bottom)], fill=GRID_COLOR, width=1)
     
-    labels = []
-    est_tz = pytz.timezone('US/Eastern')
+    # Interleave coordinates into the flat [x0, y0, x1, y1, ...] form Pillow accepts
+    points = np.column_stack((x_px, y_px)).ravel().tolist()
     
-    for idx in indices:
-        # Convert milliseconds to datetime in UTC, then to EST
-        dt_utc = datetime.fromtimestamp(timestamps[idx] / 1000, tz=pytz.UTC)
-        dt_est = dt_utc.astimezone(est_tz)
-        labels.append(dt_est.strftime(date_format))
+    # Fill area under the curve (from y_min to show relative change)
+    draw.polygon(points + [x_px[-1], plot_bottom, x_px[0], plot_bottom], fill=FILL_COLOR)
+    
+    # Plot the spark line
+    if len(sample_indices) > 1:
+        draw.line(points, fill=LINE_COLOR, width=LINE_WIDTH, joint='curve')
+    else:
+        draw.point(points, fill=LINE_COLOR)
     
-    ax.set_xticklabels(labels, fontsize=8)
-    ax.set_xlabel('Time (EST)', fontsize=10)
+    # Configure axes (left and bottom spines only)
+    draw.line([(plot_left, plot_top), (plot_left, plot_bottom)], fill=AXIS_COLOR, width=1)
+    draw.line([(plot_left, plot_bottom), (plot_right, plot_bottom)], fill=AXIS_COLOR, width=1)
+    
+    for tick, label in zip(y_ticks, y_tick_labels):
+        y = to_y(tick)
+        draw.line([(plot_left - TICK_LENGTH, y), (plot_left, y)], fill=AXIS_COLOR, width=1)
+        draw.text((plot_left - 2 * TICK_LENGTH, y), label, font=assets.tick_font, fill=AXIS_COLOR, anchor='rm')
+    
+    for idx, label in zip(indices, x_tick_labels):
+        x = to_x(idx)
+        draw.line([(x, plot_bottom), (x, plot_bottom + TICK_LENGTH)], fill=AXIS_COLOR, width=1)
+        draw.multiline_text((x, plot_bottom + 2 * TICK_LENGTH), label, font=assets.tick_font,
+                            fill=AXIS_COLOR, anchor='ma', align='center')
+    
+    img.paste(AXIS_COLOR, (2, int((plot_top + plot_bottom - assets.y_label_mask.height) / 2)), assets.y_label_mask)
+    draw.text(((plot_left + plot_right) / 2, height - X_LABEL_INSET), 'Time (EST)', font=assets.label_font,
+              fill=AXIS_COLOR, anchor='md')
     
     # Add title with ticker and company name
-    plt.title(f'{ticker} - {company_name}', fontsize=14, fontweight='bold', pad=15)
+    draw.text(((plot_left + plot_right) / 2, 8), title, font=assets.title_font, fill=AXIS_COLOR, anchor='ma')
     
     # Add current price annotation
     current_price = values[-1]
@@ -237,27 +548,33 @@ def create_spark_graph_image(prices, ticker, company_name, size=(480, 480)):
     price_change_pct = (price_change / values[0]) * 100
     
     # Color based on price change
-    change_color = '#2ca02c' if price_change >= 0 else '#d62728'
+    change_color = UP_COLOR if price_change >= 0 else DOWN_COLOR
     
     # Add price info as text
     price_text = f'${current_price:,.2f}'
     change_text = f'{"+" if price_change >= 0 else ""}{price_change:.2f} ({price_change_pct:+.2f}%)'
     
-    ax.text(0.02, 0.98, price_text, transform=ax.transAxes, 
-            fontsize=12, fontweight='bold', verticalalignment='top')
-    ax.text(0.02, 0.91, change_text, transform=ax.transAxes, 
-            fontsize=10, color=change_color, verticalalignment='top')
-    
-    # Adjust layout
-    plt.tight_layout()
+    text_x = plot_left + plot_width * 0.02
+    draw.text((text_x, plot_top + plot_height * 0.02), price_text, font=assets.price_font,
+              fill=AXIS_COLOR, anchor='la')
+    draw.text((text_x, plot_top + plot_height * 0.09), change_text, font=assets.label_font,
+              fill=change_color, anchor='la')
+    
+    # Save to this thread's reusable BytesIO object. It is rewound rather than
+    # truncated (truncating would release its memory), so only the bytes
+    # written by this call are returned.
+    buffer = getattr(_thread_local, 'png_buffer', None)
+    if buffer is None:
+        buffer = _thread_local.png_buffer = BytesIO(bytearray(PNG_BUFFER_SIZE))
+    buffer.seek(0)
     
-    # Save to BytesIO object
-    buffer = BytesIO()
-    plt.savefig(buffer, format='png', dpi=dpi, bbox_inches='tight', facecolor='white')
-    plt.close()
+    # Fast zlib level: spark graphs are small and transient, so the extra CPU of
+    # the default level buys almost nothing in file size
+    img.save(buffer, format='PNG', compress_level=1, optimize=False)
+    png_size = buffer.tell()
     
-    buffer.seek(0)
-    return buffer.getvalue()
+    with buffer.getbuffer() as view:
+        return view[:png_size].tobytes()
 
 
 @functions_framework.http
@@ -299,14 +616,36 @@ def generate_spark_graph(request):
         if width < 100 or height < 100 or width > 2000 or height > 2000:
             return jsonify({'error': 'Size must be between 100x100 and 2000x2000'}), 400
         
-        # Get duration parameters
-        start_date, end_date, timespan, multiplier = get_duration_params(duration)
+        # Validate duration before making any upstream call
+        if duration not in CACHE_TTL:
+            raise ValueError(f"Invalid duration: {duration}")
+        
+        # Fetch company name in the background while fetching stock data (cached per duration)
+        company_name_future = EXECUTOR.submit(fetch_company_name, ticker)
+        try:
+            stock_data = get_stock_data(ticker, duration)
+        except Exception:
+            # No graph will be drawn, so drop the lookup if it hasn't started yet
+            company_name_future.cancel()
+            raise
+        company_name = company_name_future.result()
         
-        # Fetch company name
-        company_name = fetch_company_name(ticker)
+        # Identify the graph by its inputs: the latest bar (its close keeps moving
+        # while the bar is in progress) and the company name shown in the title
+        last_bar = stock_data[-1]
+        etag = hashlib.md5(
+            f"{ticker}{duration}{width}x{height}{last_bar['t']}{last_bar['c']}{company_name}".encode()
+        ).hexdigest()
+        max_age = HTTP_CACHE_MAX_AGE[duration]
+        cache_headers = {
+            'Cache-Control': f'public, max-age={max_age}, s-maxage={max_age * 2}',
+            'ETag': f'"{etag}"',
+            'Vary': 'Authorization'
+        }
         
-        # Fetch stock data
-        stock_data = fetch_stock_data(ticker, start_date, end_date, timespan, multiplier)
+        # Client already has this graph
+        if request.if_none_match.contains_weak(etag):
+            return make_response('', 304, cache_headers)
         
         # Generate spark graph
         image_data = create_spark_graph_image(stock_data, ticker, company_name, size)
@@ -314,7 +653,7 @@ def generate_spark_graph(request):
         # Return PNG image
         response = make_response(image_data)
         response.headers['Content-Type'] = 'image/png'
-        response.headers['Cache-Control'] = 'public, max-age=300'  # Cache for 5 minutes
+        response.headers.update(cache_headers)
         
         return response
         
@@ -327,5 +666,7 @@ def generate_spark_graph(request):
             return jsonify({'error': 'Ticker not found'}), 404
         else:
             return jsonify({'error': 'Error fetching stock data'}), 500
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        return jsonify({'error': 'Could not reach Polygon.io'}), 502
     except Exception as e:
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
\ No newline at end of file